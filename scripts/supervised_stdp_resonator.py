@@ -1,9 +1,18 @@
 import os
+# keep the compiled functions (`njit(cache=True)`) between runs and share them with the worker processes,
+# numba reads it when it is imported, so set it before importing snn. Other entry points can export NUMBA_CACHE_DIR
+os.environ.setdefault('NUMBA_CACHE_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                      '.numba_cache'))
 import json
+import multiprocessing
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from functools import partial
 
+import matplotlib
+# figures are only saved to files, also from the worker processes
+matplotlib.use('Agg')
 from tqdm import tqdm
 from matplotlib import pyplot as plt
 from numpy.polynomial.polynomial import Polynomial
@@ -16,34 +25,44 @@ from snn.spiking_neuron import create_SCTN, IDENTITY
 from snn.resonator import test_resonator_on_chirp, freq_of_resonator
 
 
-def neuron_output(neuron, signal_freq, shift_degrees=0, phase_number=20):
-    y_events = neuron.out_spikes()
+def output_bounds(signal_freq, shift_degrees=0, phase_number=20):
     samples_per_cycle = clk_freq / signal_freq
     samples_per_degree = samples_per_cycle/360
     shift_samples = int(shift_degrees*samples_per_degree)
-    y_events = y_events[
-        (y_events > ((phase_number-1)/signal_freq) * clk_freq + shift_samples) &
-        (y_events < ((phase_number/signal_freq) * clk_freq) + shift_samples)
-    ]
-    if len(y_events) == 0:
-        return y_events
-    return y_events
+    return (((phase_number-1)/signal_freq) * clk_freq + shift_samples,
+            ((phase_number/signal_freq) * clk_freq) + shift_samples)
 
 
-def events_to_spikes(events, run_window=0, spikes_arr_size=-1):
-    if spikes_arr_size == -1:
+def neuron_output(neuron, signal_freq, shift_degrees=0, phase_number=20, bounds=None):
+    y_events = neuron.out_spikes()
+    low, high = bounds or output_bounds(signal_freq, shift_degrees, phase_number)
+    return y_events[(y_events > low) & (y_events < high)]
+
+
+def events_to_spikes(events, run_window=0, spikes_arr_size=-1, y_spikes=None, out=None):
+    """
+    :param y_spikes: optional buffer for the spikes array, reused instead of allocating one
+    :param out: optional buffer for the rolling sum
+    """
+    if y_spikes is not None:
+        y_spikes[:] = 0
+    elif spikes_arr_size == -1:
         y_spikes = np.zeros(events[-1] + 1)
     else:
         y_spikes = np.zeros(spikes_arr_size)
-
     y_spikes[events] = 1
     if run_window == 0:
         return y_spikes
-
-    y_spikes_rollsum = np.convolve(y_spikes, np.ones(run_window, dtype=int), 'valid')
+    y_spikes_rollsum = rolling_sum(y_spikes, run_window, out=out)
     return y_spikes_rollsum
 
 
+def rolling_sum(arr, window, out=None):
+    # same as np.convolve(arr, np.ones(window), 'valid') in O(len(arr))
+    c = np.concatenate(([0], arr.cumsum()))
+    return np.subtract(c[window:], c[:-window], out=out)
+
+
 def learning_resonator(
         lf,
         freq0,
@@ -198,6 +217,7 @@ def estimated_parameters_for_resonator(freq0, lf, clk_freq, polynom_deg=4):
 
 def search_for_parameters(freq0, lf, thetas, weights, phase, xi=22.5, learnable_neurons=None, gain=8):
     learnable_neurons = learnable_neurons or [0, 1, 2, 3]
+    target_freq = freq0
     best_lp = lp_by_lf(lf, freq0, clk_freq)
     freq0 = freq_of_resonator(clk_freq, lf, best_lp)
 
@@ -276,43 +296,68 @@ def search_for_parameters(freq0, lf, thetas, weights, phase, xi=22.5, learnable_
     min_mse_thetas_tuned = flat_thetas(resonator)
     min_mse_tuned = np.array([(gt**2).mean() for gt in ground_truth]).mean()*100
 
-    momentum = [0] * 4
+    momentum = np.zeros(4)
     max_theta = -.75
 
     y_epsilon = spikes_window * 0.035
     x_epsilon = len(rresonator_input) * 10 / 360
-    gt_peaks = [argmax(gt) for gt in rolling_gt]
+    gt_peaks = np.array([argmax(gt) for gt in rolling_gt])
+    gt_maxs, gt_mins = np.array(gt_wave_amplitudes).T
 
     count_to_finish = -1
     epochs_after_tuning = 100
     epoch = 0
+
+    # the output window and array sizes are the same every epoch, only the spikes change
+    spikes_arr_size = int(clk_freq/freq0)+1
+    phase_bounds = output_bounds(freq0, phase_number=phase)
+    y_spikes_buf = np.zeros(spikes_arr_size, dtype=np.int32)
+    rollsum_buf = np.zeros((4, spikes_arr_size - spikes_window + 1), dtype=np.int64)
+    x = np.linspace(0, 360, len(rresonator_input))
+    x0 = int(argmax(rresonator_input))
+
+    # `neurons` is a property that builds a new list on every access
+    neurons = resonator.neurons
+    neurons_tail = neurons[1:]
+    # float32 mirror of the thetas of neurons_tail, synced to the neurons once per epoch
+    theta_arr = np.array([neuron.theta for neuron in neurons_tail], dtype=np.float32)
+    postfix_every = 10
+    # the pdm encoding of sine_wave only depends on the state the pdm neuron starts the epoch with,
+    # record it once per starting state (with the state it ends in) and replay it.
+    # the pdm neuron isn't ticked on replayed epochs, so its out_spikes() log is empty on them
+    pdm_cache = {}
     with tqdm() as pbar:
         while count_to_finish != 0:
             learn = True
             count_to_finish -= 1
             tuned_parameters = 0
-            for neuron in resonator.neurons:
+            for neuron in neurons:
                 neuron.membrane_potential = 0
                 neuron.log_rand_gauss_var = 0
             resonator.forget_logs()
-            resonator.input_full_data(sine_wave)
-            output = [events_to_spikes(neuron_output(neuron, freq0, phase_number=phase)-resonator_input[0],
+            pdm_start = neurons[0].state()
+            if pdm_start not in pdm_cache:
+                resonator.input_full_data(sine_wave)
+                pdm_spikes = np.zeros((len(sine_wave), 1), dtype=np.int32)
+                pdm_spikes[neurons[0].out_spikes(), 0] = 1
+                pdm_cache[pdm_start] = pdm_spikes, neurons[0].state()
+            else:
+                pdm_spikes, pdm_end = pdm_cache[pdm_start]
+                resonator.input_full_data_prespike(pdm_spikes)
+                neurons[0].set_state(pdm_end)
+            output = [events_to_spikes(neuron_output(neuron, freq0, bounds=phase_bounds)-resonator_input[0],
                                        run_window=spikes_window,
-                                       spikes_arr_size=int(clk_freq/freq0)+1)
-                      for neuron in resonator.neurons[1:]]
-
-            for j, o in enumerate(output):
-                o_max, o_min = o.max(), o.min()
-                o_argmax = argmax(o)
-                if abs(o_argmax - gt_peaks[j]) <= x_epsilon:
-                    tuned_parameters += 1
-                # if ((o_max - gt_wave_amplitudes[j][0]) >= -y_epsilon and
-                #         (o_min - gt_wave_amplitudes[j][1]) <= y_epsilon
-                # ):
-                if (abs(o_max - gt_wave_amplitudes[j][0]) <= y_epsilon and
-                        abs(o_min - gt_wave_amplitudes[j][1]) <= y_epsilon
-                ):
-                    tuned_parameters += 1
+                                       y_spikes=y_spikes_buf,
+                                       out=rollsum_buf[j])
+                      for j, neuron in enumerate(neurons_tail)]
+            # the outputs are the rows of rollsum_buf
+            o_maxs, o_mins, dc = rollsum_buf.max(axis=1), rollsum_buf.min(axis=1), rollsum_buf.mean(axis=1)
+            peaks = np.array([argmax(o) for o in output])
+
+            tuned_parameters += np.count_nonzero(np.abs(peaks - gt_peaks) <= x_epsilon)
+            # tuned_parameters += np.count_nonzero((o_maxs - gt_maxs >= -y_epsilon) & (o_mins - gt_mins <= y_epsilon))
+            tuned_parameters += np.count_nonzero((np.abs(o_maxs - gt_maxs) <= y_epsilon) &
+                                                 (np.abs(o_mins - gt_mins) <= y_epsilon))
             if tuned_parameters == 8 and count_to_finish < 0:
                 count_to_finish = epochs_after_tuning
 
@@ -336,39 +381,33 @@ def search_for_parameters(freq0, lf, thetas, weights, phase, xi=22.5, learnable_
                 min_mse_weights_tuned = flat_weights(resonator)
 
             if learn:
-                thetas_shift = [-.2*(((2*np.mean(o) - spikes_window)/spikes_window)**2)*np.sign(np.mean(o)-spikes_window/2) for o in output]
-                for j, neuron in enumerate(resonator.neurons[1:]):
-                    bs = thetas_shift[j]
-                    momentum[j] = bs + momentum_beta * momentum[j]
-                    neuron.theta += momentum[j]
-                    if neuron.theta > max_theta:
-                        neuron.theta = max_theta
+                thetas_shift = -.2*(((2*dc - spikes_window)/spikes_window)**2)*np.sign(dc - spikes_window/2)
+                momentum = thetas_shift + momentum_beta * momentum
+                theta_arr[:] = np.minimum(theta_arr + momentum, max_theta)
 
             # activate weights learning
-            peaks = [argmax(o)for o in output]
             for j, o in enumerate(output):
                 if j not in learnable_neurons:
                     continue
-                o_max = o.max()
-                o_min = o.min()
-                neuron = resonator.neurons[1 + j]
-                o_argmax = argmax(o)
+                o_max = o_maxs[j]
+                o_min = o_mins[j]
+                neuron = neurons_tail[j]
 
                 if (learn and
-                        abs(o_argmax - gt_peaks[j]) <= 5 * x_epsilon# and
+                        abs(peaks[j] - gt_peaks[j]) <= 5 * x_epsilon# and
                         # abs(o_max - gt_wave_amplitudes[j][0]) > y_epsilon/4 and
                         # abs(o_min - gt_wave_amplitudes[j][1]) > y_epsilon/4
                 ):
                     # 100 mse -> stretch_or_shrink_scale 0.001
                     stretch_or_shrink_scale = 2*(mses[j]*1000//1e4) / 1e4
                     if gt_wave_amplitudes[j][1] < o_min < o_max < gt_wave_amplitudes[j][0]:
-                        neuron.theta -= stretch_or_shrink_scale
+                        theta_arr[j] -= stretch_or_shrink_scale
                         neuron.synapses_weights[0] += 2 * stretch_or_shrink_scale #/ len(neuron.synapses_weights)
                         if j == 0:
                             neuron.synapses_weights[1] -= 2 * stretch_or_shrink_scale  # / len(neuron.synapses_weights)
                     elif o_min < gt_wave_amplitudes[j][1] < gt_wave_amplitudes[j][0] < o_max:
                         stretch_or_shrink_scale *= 2
-                        neuron.theta += stretch_or_shrink_scale
+                        theta_arr[j] += stretch_or_shrink_scale
                         neuron.synapses_weights[0] -= 2 * stretch_or_shrink_scale #/ len(neuron.synapses_weights)
                         if j == 0:
                             neuron.synapses_weights[1] += 2 * stretch_or_shrink_scale  # / len(neuron.synapses_weights)
@@ -386,19 +425,22 @@ def search_for_parameters(freq0, lf, thetas, weights, phase, xi=22.5, learnable_
                     neuron.supervised_stdp.A = (1 + wave_amplitude_ratio) * 10e-5
                     neuron.supervised_stdp.tau = 1e-5 * clk_freq / 2 * (1 + phase_diff_ratio)
 
+            for neuron, theta in zip(neurons_tail, theta_arr):
+                neuron.theta = theta
+
             # check for xi for all of the neurons
-            x = np.linspace(0, 360, len(rresonator_input))
-            x0 = int(argmax(rresonator_input))
-            xi_s = np.array([x[int(argmax(output[i]))] - x[x0] for i in range(4)])
-
-            wave_amplitudes = np.array([o.max() - o.min() for o in output])
-            pbar.set_postfix({'weights': flat_weights(resonator).tolist(),
-                              'thetas': flat_thetas(resonator), 'mse': curr_mse,
-                              'amplitudes': wave_amplitudes.tolist(), 'dc': [int(o.mean()) for o in output],
-                              'min_weight': min_mse_weights.tolist(), 'min_thetas': min_mse_thetas, 'min_mse': min_mse,
-                              'min_weight_tuned': min_mse_weights_tuned, 'min_thetas_tuned': min_mse_thetas_tuned, 'min_mse_tuned': min_mse_tuned,
-                              'tuned_parameters': tuned_parameters, 'xi': xi_s.tolist(),
-                              'epochs_left': epochs_after_tuning if count_to_finish < 0 else count_to_finish})
+            xi_s = x[peaks.astype(int)] - x[x0]
+
+            wave_amplitudes = o_maxs - o_mins
+            # the postfix is expensive to build, refresh it only every few epochs or on a new min mse
+            if epoch % postfix_every == 0 or not learn:
+                pbar.set_postfix({'weights': flat_weights(resonator).tolist(),
+                                  'thetas': flat_thetas(resonator), 'mse': curr_mse,
+                                  'amplitudes': wave_amplitudes.tolist(), 'dc': dc.astype(int).tolist(),
+                                  'min_weight': min_mse_weights.tolist(), 'min_thetas': min_mse_thetas, 'min_mse': min_mse,
+                                  'min_weight_tuned': min_mse_weights_tuned, 'min_thetas_tuned': min_mse_thetas_tuned, 'min_mse_tuned': min_mse_tuned,
+                                  'tuned_parameters': tuned_parameters, 'xi': xi_s.tolist(),
+                                  'epochs_left': epochs_after_tuning if count_to_finish < 0 else count_to_finish})
 
             xi_diff = np.abs(xi_s - desired_xi)
             ampl_diff = np.abs(wave_amplitudes - 130)
@@ -483,7 +525,7 @@ def search_for_parameters(freq0, lf, thetas, weights, phase, xi=22.5, learnable_
         y_events = spikes_neuron.out_spikes()
         y_spikes = np.zeros(test_size)
         y_spikes[y_events] = 1
-        y_spikes = np.convolve(y_spikes, np.ones(spikes_window, dtype=int), 'valid')
+        y_spikes = rolling_sum(y_spikes, spikes_window)
         x = np.linspace(start_freq, start_freq+spectrum, len(y_spikes))
 
         ax = axs[nid//2, nid%2]
@@ -504,7 +546,7 @@ def search_for_parameters(freq0, lf, thetas, weights, phase, xi=22.5, learnable_
 
     with open(f"../filters{lf}{postfix}/clk_{clk_freq}/parameters/f_{int(freq0)}.json", 'w') as best_params_f:
         parameters = {
-            'freq0': float(freq),
+            'freq0': float(target_freq),
             'f_resonator': float(f_resonator),
             "lf": lf,
             'mse': list(min_neurons_mses),
@@ -547,17 +589,31 @@ def run_chirp(freq0, spikes_window=500):
     y_events = spikes_neuron.out_spikes()
     y_spikes = np.zeros(test_size)
     y_spikes[y_events] = 1
-    y_spikes = np.convolve(y_spikes, np.ones(spikes_window, dtype=int), 'valid')
+    y_spikes = rolling_sum(y_spikes, spikes_window)
 
     with open(f"../filters{lf}{postfix}/clk_{clk_freq}/chirp/f_{int(freq0)}.json", 'w') as best_params_f:
         parameters = {
-            'freq0': float(freq),
+            'freq0': float(freq0),
             'max': np.max(y_spikes),
             "mean": np.mean(y_spikes),
             'min': np.min(y_spikes),
         }
         json.dump(parameters, best_params_f, indent=4)
 
+
+def search_for_parameters_parallel(freqs, thetas, weights, processes=6, **kwargs):
+    """
+    Search the parameters of every freq in a separate process.
+    All the searches start from the same thetas and weights (no warm start from the previous freq),
+    so they are independent of each other.
+    :param kwargs: passed to search_for_parameters (phase, xi, learnable_neurons, gain)
+    :return: list of (thetas, weights), in the order of freqs
+    """
+    search = partial(search_for_parameters, lf=lf, thetas=thetas, weights=weights, **kwargs)
+    with multiprocessing.Pool(processes=processes) as pool:
+        return pool.map(search, freqs)
+
+
 lf = 4
 clk_freq = 1536000
 # postfix = '_std'
@@ -594,16 +650,19 @@ freqs = [105, 110, 115, 128, 130, 159, 160, 166, 190, 195, 221, 250, 288, 305, 3
 #                                                       phase=20, xi=0, learnable_neurons=[0, 1, 2, 3],
 #                                                       gain=26)
 
-# run chirps on these signals:
-freqs = np.array([
-    [110, 130, 160, 190, 221, 250, 195, 282, 305, 347, 402, 436],
-    [288, 305, 339, 372, 412, 462, 898, 105, 115, 128, 159, 166],
-    [509, 545, 587, 636, 694, 763, 477, 526,   0,   0,   0,   0]
-])[2, :]
-
-print(f'run on {freqs}')
-for freq in freqs:
-    if freq > 0:
-        run_chirp(freq, spikes_window=100)
+if __name__ == '__main__':
+    # search_for_parameters_parallel(freqs, init_thetas, init_weights,
+    #                                phase=20, xi=0, learnable_neurons=[0, 1, 2, 3], gain=26)
+
+    # run chirps on these signals:
+    freqs = np.array([
+        [110, 130, 160, 190, 221, 250, 195, 282, 305, 347, 402, 436],
+        [288, 305, 339, 372, 412, 462, 898, 105, 115, 128, 159, 166],
+        [509, 545, 587, 636, 694, 763, 477, 526,   0,   0,   0,   0]
+    ])[2, :]
+
+    print(f'run on {freqs}')
+    with multiprocessing.Pool(processes=6) as pool:
+        pool.map(partial(run_chirp, spikes_window=100), freqs[freqs > 0])
 
 
@@ -75,12 +75,12 @@ class DirectedEdgeListGraph:
             self.spikes[nid] = 0
 
 
-@njit
+@njit(cache=True)
 def njit_empty_list():
     return [np.array([np.int32(0)]) for _ in range(0)]
 
 
-@njit
+@njit(cache=True)
 def njit_empty_array():
     return np.array([np.int32(0) for _ in range(0)])
 
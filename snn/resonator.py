@@ -271,7 +271,7 @@ def test_resonator_on_chirp(network, test_size=10_000_000, start_freq=0, clk_fre
         test_size -= sine_size
 
 
-@njit
+@njit(cache=True)
 def create_chirp_signal(test_size, clk_freq, start_freq, step, shift):
     sine_wave = (np.arange(test_size) * step + start_freq + step)
     sine_wave = sine_wave * 2 * np.pi / clk_freq
@@ -280,7 +280,7 @@ def create_chirp_signal(test_size, clk_freq, start_freq, step, shift):
 
 
 
-@njit
+@njit(cache=True)
 def freq_of_resonator(clk_freq, LF, LP):
     return clk_freq / ((2 ** LF) * 2 * np.pi * (1 + LP))
 
@@ -2,7 +2,7 @@ import numpy as np
 from numba import njit
 
 
-@njit
+@njit(cache=True)
 def generate_sine_wave(sine_size, clk_freq=1536000, amplitude=1000, zoom=200000, phase0=0):
     sine_wave = (np.arange(sine_size) / zoom + phase0)
     sine_wave = sine_wave * 2 * np.pi / clk_freq
@@ -10,7 +10,7 @@ def generate_sine_wave(sine_size, clk_freq=1536000, amplitude=1000, zoom=200000,
     return np.floor(np.sin(sine_wave) * amplitude)
 
 
-@njit
+@njit(cache=True)
 def BSA_encoder(_input, threshold):
     _filter = [8, 16, 26, 35, 44, 52, 59, 64, 65, 64, 61, 57, 52, 45, 37, 29, 21, 13, 7, 4]
     output = np.zeros(len(_input))
@@ -31,7 +31,7 @@ def BSA_encoder(_input, threshold):
             output[i] = 0
     return output
 
-@njit
+@njit(cache=True)
 def BSA_decoder(spike_train):
     _filter = [8, 16, 26, 35, 44, 52, 59, 64, 65, 64, 61, 57, 52, 45, 37, 29, 21, 13, 7, 4]
     output = np.zeros(len(spike_train))
@@ -1,17 +1,19 @@
 from utils import *
 from snn.layers import SCTNLayer
 from collections import OrderedDict
-from numba import int8, int32, float32
+from numba import int16, int32, float32
 from snn.graphs import DirectedEdgeListGraph
 from snn.spiking_neuron import SCTNeuron, create_SCTN
 
+# the clock sine is kept in Q15, 1.0 is stored as CLK_Q15_ONE
+CLK_Q15_ONE = 32767
+
 
 @jitclass(OrderedDict([
     ('clk_freq', int32),
-    ('clk_freq_i', int32),
-    ('clk_freq_qrt', int8),
+    ('clk_idx', int32),
     ('amplitude', float32[:]),
-    ('clk_freq_sine', float32[:]),
+    ('clk_sine_q15', int16[:]),
     ('enable_by', numbaListType(int32)),
     ('spikes_graph', DirectedEdgeListGraph.class_type.instance_type),
     ('layers_neurons', numbaListType(SCTNLayer.class_type.instance_type)),
@@ -19,8 +21,11 @@ from snn.spiking_neuron import SCTNeuron, create_SCTN
 ]))
 class SpikingNetwork:
 
-    def __init__(self):
+    def __init__(self, clk_freq=1536000):
         """
+        @clk_freq: number of clock cycles in a second, also the length of the clock sine period
+        @clk_sine_q15: full period of the clock sine in Q15 (int16, 32767 is 1.0), indexed by clk_idx.
+            Built on the first `_calculate_clk`, networks that don't read the clock don't pay for it
         @enable_by: list of all neurons that map if neuron is enabled by other neuron
             id is enabled by self.enable_by[id]
         @spikes_graph: DirectedEdgeListGraph graph that map connections between neurons
@@ -28,6 +33,10 @@ class SpikingNetwork:
         @neurons: list of all the neurons inside the network
         @layers_neurons: list of all the layers
         """
+        self.clk_freq = clk_freq
+        self.clk_idx = 0
+        self.clk_sine_q15 = np.zeros(0, dtype=np.int16)
+
         self.enable_by = numbaList([np.int32(0) for _ in range(0)])
         self.spikes_graph = DirectedEdgeListGraph()
 
@@ -103,8 +112,14 @@ class SpikingNetwork:
         return len(should_be_removed)
 
     def input(self, spike_train):
+        self._tick_from(0, spike_train)
+        last_neurons = np.array([n._id for n in self.layers_neurons[-1].neurons])
+        return self.spikes_graph.spikes[last_neurons]
+
+    def _tick_from(self, first_layer, spike_train):
         # first update that input neurons send spikes
-        for i, layer in enumerate(self.layers_neurons):
+        for i in range(first_layer, len(self.layers_neurons)):
+            layer = self.layers_neurons[i]
             for j, neuron in enumerate(layer.neurons):
                 enable = self.is_enable(neuron)
                 if i == 0:
@@ -112,8 +127,6 @@ class SpikingNetwork:
                 else:
                     emit_spike = neuron.ctn_cycle(self.spikes_graph.get_input_spikes_to(neuron), enable)
                 self.spikes_graph.update_spike(neuron, emit_spike)
-        last_neurons = np.array([n._id for n in self.layers_neurons[-1].neurons])
-        return self.spikes_graph.spikes[last_neurons]
 
     def input_full_data(self, data):
         classes = np.zeros(len(self.layers_neurons[-1].neurons))
@@ -122,6 +135,22 @@ class SpikingNetwork:
             classes += res
         return classes
 
+    def input_full_data_prespike(self, input_spikes):
+        """
+        Same as input_full_data, but the spikes of the first layer are given instead of computed.
+        The first layer isn't ticked (its state and logs don't change), on every clock cycle its spikes are
+        read from `input_spikes` and only the next layers are ticked.
+        @input_spikes: input_spikes[t, j] is the spike of the j'th neuron of the first layer in cycle t,
+            e.g. the recorded pdm encoding of the same data
+        """
+        input_nids = np.array([n._id for n in self.layers_neurons[0].neurons], dtype=np.int32)
+        last_nids = np.array([n._id for n in self.layers_neurons[-1].neurons], dtype=np.int32)
+        classes = np.zeros(len(last_nids))
+        _advance_prespike(self, input_spikes, input_nids, last_nids, classes)
+        # keep the clock where input_full_data would leave it
+        self.clk_idx = (self.clk_idx + len(input_spikes)) % self.clk_freq
+        return classes
+
     def input_full_data_spikes(self, spike_train, stop_on_first_spike=False):
         classes = np.zeros(len(self.layers_neurons[-1].neurons))
         for i, spikes in enumerate(spike_train):
@@ -133,6 +162,7 @@ class SpikingNetwork:
 
     def input_potential(self, potential):
         potential = (potential * self.amplitude).astype(np.int16)
+        self._advance_clk()
 
         for i, p in enumerate(potential):
             neuron = self.layers_neurons[0].neurons[i]
@@ -140,6 +170,17 @@ class SpikingNetwork:
 
         return self.input(np.zeros(len(potential)))
 
+    def _calculate_clk(self):
+        if len(self.clk_sine_q15) == 0:
+            self.clk_sine_q15 = np.round(np.sin(2 * np.pi * np.arange(self.clk_freq) / self.clk_freq)
+                                         * CLK_Q15_ONE).astype(np.int16)
+        return self.clk_sine_q15[self.clk_idx]
+
+    def _advance_clk(self):
+        self.clk_idx += 1
+        if self.clk_idx == self.clk_freq:
+            self.clk_idx = 0
+
     def forget_logs(self):
         for neuron in self.neurons:
             neuron.forget_logs()
@@ -189,5 +230,20 @@ class SpikingNetwork:
         self[neurons_id].log_out_spikes = True
 
 
+@njit
+def _advance_prespike(network, input_spikes, input_nids, last_nids, classes):
+    """
+    Feed the given spikes of the first layer, one row per clock cycle, tick the rest of the layers
+    and accumulate the spikes of the last layer into `classes` in place.
+    """
+    no_spikes = np.zeros(len(input_nids))
+    for t in range(input_spikes.shape[0]):
+        for i in range(len(input_nids)):
+            network.spikes_graph.spikes[input_nids[i]] = input_spikes[t, i]
+        network._tick_from(1, no_spikes)
+        for k in range(len(last_nids)):
+            classes[k] += network.spikes_graph.spikes[last_nids[k]]
+
+
 def get_labels(network: SpikingNetwork):
     return np.array([n.label for n in network.layers_neurons[-1].neurons])
@@ -264,6 +264,13 @@ class SCTNeuron:
         self._out_spikes_index = 0
         self.index = 0
 
+    def state(self):
+        # everything the neuron output depends on besides its input and parameters
+        return self.membrane_potential, self.rand_gauss_var, self.leakage_timer, self.pn_generator, self.index
+
+    def set_state(self, state):
+        self.membrane_potential, self.rand_gauss_var, self.leakage_timer, self.pn_generator, self.index = state
+
 
 @njit
 def create_SCTN():
@@ -2,14 +2,12 @@ import json
 import os
 import pickle
 import time
-import wave
 from distutils.dir_util import copy_tree
 from functools import wraps
 from typing import List, Dict
 
-# import librosa
 import scipy as sp
-from scipy.interpolate import interp1d
+from scipy.io import wavfile
 
 import networkx as nx
 import numpy as np
@@ -31,7 +29,9 @@ if not debug:
 
 else:
 
-    def njit(f):
+    def njit(f=None, **kwargs):
+        if f is None:
+            return lambda _f: _f
         return f
 
 
@@ -77,16 +77,19 @@ def load_audio_data(audio_path, clk_freq,
                     normalize=True,
                     resample_time_ms=0,
                     remove_silence=False):
-    gen_audio_path = f'sound{np.random.randint(10000)}.wav'
-    with open(audio_path, "rb") as inp_f:
-        data = inp_f.read()
-        with wave.open(gen_audio_path, "wb") as out_f:
-            out_f.setnchannels(1)
-            out_f.setsampwidth(2)  # number of bytes
-            out_f.setframerate(16000)
-            out_f.writeframesraw(data)
-    data, sr = librosa.load(gen_audio_path, sr=16000)
-    os.remove(gen_audio_path)
+    if audio_path.endswith('.wav'):
+        sr, data = wavfile.read(audio_path)
+        if data.ndim > 1:
+            data = data.mean(axis=1)
+        if np.issubdtype(data.dtype, np.integer):
+            data = data / (np.iinfo(data.dtype).max + 1)
+        data = data.astype(np.float32)
+    else:
+        # raw 16 kHz mono PCM16
+        with open(audio_path, "rb") as inp_f:
+            raw = inp_f.read()
+        data = np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+        sr = 16000
 
     if normalize:
         data /= np.max(np.abs(data))
@@ -100,10 +103,15 @@ def load_audio_data(audio_path, clk_freq,
         data = data[cumsum_data > th]
 
     if resample_time_ms > 0:
-        freq = int((resample_time_ms / 1000) / (len(data) / 16000) * clk_freq)
+        freq = int((resample_time_ms / 1000) / (len(data) / sr) * clk_freq)
     else:
         freq = clk_freq
-    data = librosa.resample(data, orig_sr=sr, target_sr=freq, res_type='linear')
+
+    # linear resampling
+    n_out = int(np.ceil(len(data) * freq / sr))
+    t_old = np.arange(len(data)) / sr
+    t_new = np.arange(n_out) / freq
+    data = np.interp(t_new, t_old, data).astype(np.float32)
 
     return data
 
@@ -141,31 +149,33 @@ def generate_sinc_filter(f0: float, start_freq: float, spectrum: float, points:
 
 
 def oversample(filter_array, npts):
-    interpolated = interp1d(np.arange(len(filter_array)), filter_array, axis=0, fill_value='extrapolate')
-    oversampled = interpolated(np.linspace(0, len(filter_array), npts))
-    return oversampled
+    return make_oversampler(len(filter_array), npts)(filter_array)
 
 
-def printable_weights(weights: np.ndarray):
-    weights = weights / np.max(np.abs(weights)) * 8
-    weights = np.floor(weights, dtype=np.object)
-    blocks = {
-        0: ' ',
-        1: '\u2581',
-        2: '\u2582',
-        3: '\u2583',
-        4: '\u2584',
-        5: '\u2585',
-        6: '\u2586',
-        7: '\u2587',
-        8: '\u2588',
-    }
-    colors = np.sign(weights, dtype=np.object)
-    colors[colors == 0] = ''
-    colors[colors == 1] = '\033[92m'
-    colors[colors == -1] = '\033[91m'
+def make_oversampler(len_in, npts):
+    """
+    Linear oversampling of 1d arrays of length `len_in` to `npts` points.
+    The grids are computed once, so oversampling many filters of the same length is a single np.interp each.
+    """
+    x_old = np.arange(len_in + 1)
+    x_new = np.linspace(0, len_in, npts)
+
+    def _oversample(filter_array):
+        # the new grid ends one step after the last sample, extrapolate it from the last segment
+        extended = np.append(filter_array, 2 * filter_array[-1] - filter_array[-2])
+        return np.interp(x_new, x_old, extended)
 
-    res = [f'{c}{blocks[w]}' for c, w in zip(colors, np.abs(weights))]
+    return _oversample
+
+
+WEIGHT_BLOCKS = np.array([' ', '\u2581', '\u2582', '\u2583', '\u2584', '\u2585', '\u2586', '\u2587', '\u2588'])
+# indexed by the weight sign + 1
+WEIGHT_COLORS = np.array(['\033[91m', '', '\033[92m'])
+
+
+def printable_weights(weights: np.ndarray):
+    weights = np.floor(weights / np.max(np.abs(weights)) * 8).astype(np.int8)
+    res = np.char.add(WEIGHT_COLORS[np.sign(weights) + 1], WEIGHT_BLOCKS[np.abs(weights)])
     res = ''.join(res) + '\033[91m'
     return res
 
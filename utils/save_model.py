@@ -16,6 +16,7 @@ def save_model(network, path):
 
 def network_to_dict(network):
     return {
+        'clk_freq': network.clk_freq,
         'amplitude': network.amplitude,
         'enable_by': list(network.enable_by),
         'spikes_graph': graph_to_dict(network.spikes_graph),